@@ -0,0 +1,172 @@
+"""Index of ballot fingerprints for near-duplicate (re-fed ballot) detection."""
+
+import os
+import numpy as np
+from array import array
+from itertools import combinations
+
+FINGERPRINT_BITS = 128
+
+# fingerprints at most this many bits apart are reported as duplicates
+DUPLICATE_DISTANCE = 8
+
+# The fingerprint is split into chunks, each with its own hash table. Two
+# fingerprints within Hamming distance d share at least one chunk within
+# distance d // NUM_CHUNKS, so a query only probes a few table entries per
+# chunk instead of comparing against every ballot. Ballots voted alike share
+# most of their bits, so short chunks fill up with them: five chunks of 25
+# or 26 bits, probed one bit out, keep a query on 300k such ballots at a few
+# thousand candidates.
+NUM_CHUNKS = 5
+CHUNK_BITS = [FINGERPRINT_BITS // NUM_CHUNKS + (i < FINGERPRINT_BITS % NUM_CHUNKS)
+              for i in range(NUM_CHUNKS)]
+CHUNK_SHIFTS = [sum(CHUNK_BITS[:i]) for i in range(NUM_CHUNKS)]
+
+# Candidates are checked all at once: every fingerprint is also stored as a
+# row of 16 bit words, and a lookup table counts the bits set in each word.
+# Ballots voted alike share chunks, so a query can get back thousands of
+# candidates.
+WORDS = FINGERPRINT_BITS // 16
+POPCOUNT = np.array([bin(i).count("1") for i in range(1 << 16)], dtype = np.uint8)
+
+###############################################################################
+# REQUIRES: Nothing.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns an empty index: ballot key -> fingerprint, ballot key ->
+#           path it was scanned from, ballot key -> row, the key and words of
+#           every row (None for a removed ballot), and one table of chunk
+#           value -> rows per chunk.
+def new_index():
+    return {
+        "fingerprints": {},
+        "paths": {},
+        "rows": {},
+        "keys": [],
+        "words": np.zeros((1024, WORDS), dtype = np.uint16),
+        "tables": [{} for i in range(NUM_CHUNKS)],
+    }
+
+###############################################################################
+# REQUIRES: A fingerprint.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the list of chunk values of the fingerprint.
+def get_chunks(fingerprint):
+    return [(fingerprint >> shift) & ((1 << bits) - 1) for shift, bits in zip(CHUNK_SHIFTS, CHUNK_BITS)]
+
+###############################################################################
+# REQUIRES: A fingerprint.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the fingerprint as an array of 16 bit words.
+def get_words(fingerprint):
+    return np.frombuffer(fingerprint.to_bytes(FINGERPRINT_BITS // 8, "big"), dtype = np.uint16)
+
+###############################################################################
+# REQUIRES: A chunk value, its number of bits and a search radius in bits.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns every chunk value within the radius of the given value.
+def get_chunk_neighbors(chunk, bits, radius):
+    neighbors = [chunk]
+
+    for distance in range(1, radius + 1):
+        for flipped in combinations(range(bits), distance):
+            flip = 0
+            for bit in flipped:
+                flip |= 1 << bit
+            neighbors.append(chunk ^ flip)
+
+    return neighbors
+
+###############################################################################
+# REQUIRES: An index, the key of a ballot (the SHA1 of its image), its
+#           fingerprint and the path it was scanned from.
+# MODIFIES: The index.
+# EFFECTS:  Adds the ballot to the index. A ballot already in the index (the
+#           same image scanned again) is replaced, so its path is the latest.
+def add_fingerprint(index, key, fingerprint, path):
+    if key in index["fingerprints"]:
+        remove_fingerprint(index, key)
+
+    row = len(index["keys"])
+    if row == len(index["words"]):
+        index["words"] = np.concatenate([index["words"], np.zeros_like(index["words"])])
+
+    index["fingerprints"][key] = fingerprint
+    index["paths"][key] = path
+    index["rows"][key] = row
+    index["keys"].append(key)
+    index["words"][row] = get_words(fingerprint)
+    for table, chunk in zip(index["tables"], get_chunks(fingerprint)):
+        table.setdefault(chunk, array("q")).append(row)
+
+###############################################################################
+# REQUIRES: An index and the key of a ballot in it.
+# MODIFIES: The index.
+# EFFECTS:  Removes the ballot from the index. Its row is left empty.
+def remove_fingerprint(index, key):
+    fingerprint = index["fingerprints"].pop(key)
+    del index["paths"][key]
+    row = index["rows"].pop(key)
+    index["keys"][row] = None
+
+    for table, chunk in zip(index["tables"], get_chunks(fingerprint)):
+        table[chunk].remove(row)
+        if not table[chunk]:
+            del table[chunk]
+
+###############################################################################
+# REQUIRES: An index, a fingerprint and the largest Hamming distance allowed.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns a list of (distance, key) of every ballot in the index
+#           within the distance of the fingerprint, closest first.
+def find_near_duplicates(index, fingerprint, max_distance = DUPLICATE_DISTANCE):
+    radius = max_distance // NUM_CHUNKS
+
+    buckets = []
+    for table, chunk, bits in zip(index["tables"], get_chunks(fingerprint), CHUNK_BITS):
+        for neighbor in get_chunk_neighbors(chunk, bits, radius):
+            if neighbor in table:
+                buckets.append(np.frombuffer(table[neighbor], dtype = np.int64))
+    if not buckets:
+        return []
+
+    # a candidate sharing several chunks comes back once per chunk
+    candidates = np.concatenate(buckets)
+    distances = POPCOUNT[index["words"][candidates] ^ get_words(fingerprint)].sum(axis = 1, dtype = int)
+    close = distances <= max_distance
+    rows, first = np.unique(candidates[close], return_index = True)
+
+    return sorted((int(distance), index["keys"][row])
+                  for distance, row in zip(distances[close][first], rows))
+
+###############################################################################
+# REQUIRES: The path of an index file, one "<fingerprint hex> <key> <path>"
+#           per line.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the index stored in the file, or an empty index if the
+#           file does not exist yet.
+def load_index(path):
+    index = new_index()
+
+    if not os.path.isfile(path):
+        return index
+
+    with open(path, "r") as ifile:
+        for line in ifile:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+
+            fingerprint, key, ballot_path = line.split(" ", 2)
+            add_fingerprint(index, key, int(fingerprint, 16), ballot_path)
+
+    return index
+
+###############################################################################
+# REQUIRES: An index and the path of the index file.
+# MODIFIES: The index file.
+# EFFECTS:  Writes every ballot in the index to the file.
+def save_index(index, path):
+    with open(path, "w+") as ofile:
+        for key, fingerprint in index["fingerprints"].items():
+            ofile.write("%0*x %s %s\n" % (FINGERPRINT_BITS // 4, fingerprint, key,
+                                           index["paths"][key]))
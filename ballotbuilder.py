@@ -6,20 +6,15 @@ from reportlab.lib.pagesizes import landscape, letter as PAGESIZE, A4
 from PIL import Image
 from enum import Enum
 from pdf2image import convert_from_path
+from layouts import DEFAULT_STYLE, LAYOUTS, NUM_H_MARKS, NUM_V_MARKS, get_bubble_shape, style_to_columns
 import argparse
 
 from reportlab.lib.colors import PCMYKColor, PCMYKColorSep, Color, black as BLACK, lightgrey as GREY, grey as DARKGREY
 from reportlab.lib.units import inch
 
-NUM_H_MARKS = 34
-NUM_V_MARKS = 41
-
 MARK_HEIGHT = 0.05*inch
 MARK_WIDTH = 0.17*inch
 
-BUBBLE_HEIGHT = 0.09*inch
-BUBBLE_WIDTH = 0.18*inch
-
 H_MARGIN = 0.08*inch
 V_MARGIN_TOP = 0.25*inch
 V_MARGIN_SUM = 1.14*inch
@@ -45,9 +40,35 @@ def defineAttack(n):
         return {
             '1B': Attacks.SHIFT
         }
+    if n == 3:
+        return {
+            '1A': Attacks.BAD_NO
+        }
     # ERROR - defaulting to regular ballot
     return {}
 
+# filled in bubbles per contest: 0 = No answer, 1 = Yes, 2 = No, 3 = Both
+ANSWER_CODES = {'-': 0, 'Y': 1, 'N': 2, 'B': 3}
+DEFAULT_ANSWERS = {
+    '1A': 1,
+    '1C': 2,
+    '1E': 1,
+    '1B': 1,
+    '1D': 1,
+    '1F': 2,
+}
+
+def defineAnswers(text, style):
+    if text is None:
+        return DEFAULT_ANSWERS
+
+    # one answer letter per contest, in contest ID order
+    contests = sorted(LAYOUTS[style])
+    assert len(text) == len(contests), "Need one answer per contest: " + ", ".join(contests)
+    assert all(a in ANSWER_CODES for a in text.upper()), "Answers must be one of " + "".join(ANSWER_CODES)
+
+    return {q: ANSWER_CODES[a] for q, a in zip(contests, text.upper())}
+
 def calculate_coords(page_size, block_size, num_blocks, small_margin, big_margin):
     single_size = (page_size - small_margin - big_margin - block_size) / (num_blocks - 1)
     return [small_margin + x * single_size for x in range(num_blocks)]
@@ -55,7 +76,7 @@ def calculate_coords(page_size, block_size, num_blocks, small_margin, big_margin
 def drawTimingMark(c, x, y):
     c.rect(x, y, MARK_WIDTH, MARK_HEIGHT, fill=1)
 
-def drawTimingMarks(c):
+def drawTimingMarks(c, style=DEFAULT_STYLE):
     # h_margin = 
     vertical = calculate_coords(PAGESIZE[1], MARK_HEIGHT, NUM_V_MARKS, V_MARGIN_BOT, V_MARGIN_TOP)
     horizontal = calculate_coords(PAGESIZE[0], MARK_WIDTH, NUM_H_MARKS, H_MARGIN, H_MARGIN)
@@ -76,19 +97,40 @@ def drawTimingMarks(c):
             continue
         drawTimingMark(c, h, top_side)
     
-    for x in [1, -3, -2, NUM_H_MARKS // 2]:
+    # bottom row encodes the ballot style
+    for x in style_to_columns(style):
         drawTimingMark(c, horizontal[x], vertical[0])
 
     return horizontal, vertical
     
 
-def drawBubble(c, x, y, fill=0, text=None):
-    c.ellipse(x, y, x+BUBBLE_WIDTH, y+BUBBLE_HEIGHT, fill=fill)
+def bubbleBounds(x, y, axes, shape):
+    # bubble geometry is in timing mark cells, measured from the center of
+    # the mark at (x, y) with y pointing down the page
+    x_ax, y_ax = axes
+    half_width, half_height, offset_x, offset_y, corner = shape
+    unit_width = x_ax[1] - x_ax[0]
+    unit_height = y_ax[1] - y_ax[0]
+
+    center_x = x + MARK_WIDTH/2 + offset_x * unit_width
+    center_y = y + MARK_HEIGHT/2 - offset_y * unit_height
+    return (center_x - half_width * unit_width, center_y - half_height * unit_height,
+            center_x + half_width * unit_width, center_y + half_height * unit_height)
+
+def drawBubble(c, x, y, axes, shape, fill=0, text=None):
+    left, bottom, right, top = bubbleBounds(x, y, axes, shape)
+    corner = shape[4]
+    if corner is None:
+        c.ellipse(left, bottom, right, top, fill=fill)
+    else:
+        radius = corner * (axes[0][1] - axes[0][0] + axes[1][1] - axes[1][0]) / 2
+        c.roundRect(left, bottom, right - left, top - bottom, radius, fill=fill)
     if text is not None:
-        c.drawString(x + BUBBLE_WIDTH + 0.05*inch, y, text)
+        c.drawString(right + 0.05*inch, bottom, text)
 
-def drawQuestion(c, indices, axes, attack=None, yes_fill=0, no_fill=0):
+def drawQuestion(c, indices, axes, attack=None, yes_fill=0, no_fill=0, style=DEFAULT_STYLE):
     x_ax, y_ax = axes
+    shape = get_bubble_shape(style)
 
     x = x_ax[indices[0]]
     y = y_ax[indices[1]]
@@ -104,16 +146,16 @@ def drawQuestion(c, indices, axes, attack=None, yes_fill=0, no_fill=0):
             y, y_yes = y_yes, 2*y_yes - y
 
     c.setStrokeColor(GREY)
-    drawBubble(c, x, y, fill=no_fill, text='NO')
-    drawBubble(c, x, y_yes, fill=yes_fill, text='YES')
+    drawBubble(c, x, y, axes, shape, fill=no_fill, text='NO')
+    drawBubble(c, x, y_yes, axes, shape, fill=yes_fill, text='YES')
 
     # Post bubble
     if attack is not None:
         if attack == Attacks.BAD_YES or attack == Attacks.BAD_NO:
             c.setStrokeColor(DARKGREY)
-            line_y = y_yes if attack == Attacks.BAD_YES else y
-            line_y += BUBBLE_HEIGHT/2
-            c.line(x-0.035*inch, line_y, x+0.01*inch, line_y)
+            left, bottom, right, top = bubbleBounds(x, y_yes if attack == Attacks.BAD_YES else y, axes, shape)
+            line_y = (bottom + top) / 2
+            c.line(left-0.035*inch, line_y, left+0.01*inch, line_y)
 
 def drawRectangle(c, indices, dimensions, axes):
     x_ax, y_ax = axes
@@ -128,25 +170,8 @@ def drawRectangle(c, indices, dimensions, axes):
     c.setStrokeColor(BLACK)
     c.rect(x, y, width * unit_width, height * unit_height)
 
-def drawQuestions(c, axes, attacks={}):
-    questions = {
-        '1A': ((1, 19), (11, 15)), 
-        '1C': ((12, 19), (11, 15)),
-        '1E': ((23, 21), (10, 13)),
-        '1B': ((1, 10), (11, 9)),
-        '1D': ((12, 9), (11, 10)),
-        '1F': ((23, 5), (10, 16)),
-    }
-
-    # filled in bubbles
-    answers = { # 0 = No answer, 1 = Yes, 2 = No, 3 = Both
-        '1A': 1,
-        '1C': 2,
-        '1E': 1,
-        '1B': 1,
-        '1D': 1,
-        '1F': 2,
-    }
+def drawQuestions(c, axes, attacks={}, style=DEFAULT_STYLE, answers=DEFAULT_ANSWERS):
+    questions = LAYOUTS[style]
 
     # attacks = {
     #     '1A': Attacks.BAD_YES,
@@ -157,7 +182,7 @@ def drawQuestions(c, axes, attacks={}):
         indices, dimensions = params
         drawRectangle(c, indices, dimensions, axes)
         a = answers.get(q, 0)
-        drawQuestion(c, indices, axes, attacks.get(q, None), yes_fill=a%2, no_fill=a//2)
+        drawQuestion(c, indices, axes, attacks.get(q, None), yes_fill=a%2, no_fill=a//2, style=style)
 
 def saveCanvas(c, pdfName, name):
     c.save()
@@ -170,8 +195,8 @@ def runAttack(args):
     pdfmetrics.registerFont(TTFont('answer_font', 'Raleway-Regular.ttf'))
     c.setFont('answer_font', 10)
 
-    axes = drawTimingMarks(c)
-    drawQuestions(c, axes, defineAttack(args.attack))
+    axes = drawTimingMarks(c, args.style)
+    drawQuestions(c, axes, defineAttack(args.attack), args.style, defineAnswers(args.answers, args.style))
 
     saveCanvas(c, pdfName, args.output)
 
@@ -179,4 +204,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ballot Attacker Parser")
     parser.add_argument('attack', type=int, nargs='?', help="Attack number. If blank, no attack used.", default=0)
     parser.add_argument('output', type=str, nargs='?', help="JPG file to output", default='test.jpg')
+    parser.add_argument('--style', type=int, choices=sorted(LAYOUTS), help="Ballot style ID printed on the bottom row", default=DEFAULT_STYLE)
+    parser.add_argument('--answers', type=str, help="Bubbles to fill, one of Y/N/B/- per contest in ID order (e.g. YYNYYN)", default=None)
     runAttack(parser.parse_args())
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""Ballot styles shared by the ballot builder and the scanner."""
+
+NUM_H_MARKS = 34
+NUM_V_MARKS = 41
+
+# The bottom row of timing marks encodes the ballot style. The anchor mark in
+# the middle column is always printed (the scanner uses it for the top to
+# bottom tilt), as are the two marks near the right corner. The other inner
+# columns carry the style ID in binary, column 1 being the least significant
+# bit, and a parity column next to the corner marks makes the number of marks
+# in the code and parity columns even, so one smudged or dropped mark never
+# turns one valid code into another.
+STYLE_ANCHOR_COLUMN = NUM_H_MARKS // 2
+STYLE_FIXED_COLUMNS = [STYLE_ANCHOR_COLUMN, NUM_H_MARKS - 3, NUM_H_MARKS - 2]
+STYLE_PARITY_COLUMN = NUM_H_MARKS - 4
+STYLE_CODE_COLUMNS = [column for column in range(1, NUM_H_MARKS - 1)
+                      if column not in STYLE_FIXED_COLUMNS + [STYLE_PARITY_COLUMN]]
+
+DEFAULT_STYLE = 1
+
+# Humboldt County's May 2009 ballots print marks in columns 1 and 25 (and so
+# no parity mark), two marks apart from style 1
+HUMBOLDT_STYLE = DEFAULT_STYLE | (1 << STYLE_CODE_COLUMNS.index(25))
+
+# style ID -> contest ID -> ((column, row) of the NO bubble, (width, height) of
+# the contest box), in timing mark cells. Rows count up from the bottom row of
+# timing marks, the YES bubble sits one row above the NO bubble. ballotbuilder
+# draws from this and the scanner compiles it, so the two always agree.
+LAYOUTS = {
+    1: {
+        '1A': ((1, 19), (11, 15)),
+        '1C': ((12, 19), (11, 15)),
+        '1E': ((23, 21), (10, 13)),
+        '1B': ((1, 10), (11, 9)),
+        '1D': ((12, 9), (11, 10)),
+        '1F': ((23, 5), (10, 16)),
+    },
+}
+
+# the Humboldt ballots print the same bubbles as style 1, but the top row of
+# contest boxes starts a row lower (below the instructions)
+LAYOUTS[HUMBOLDT_STYLE] = dict(LAYOUTS[DEFAULT_STYLE])
+LAYOUTS[HUMBOLDT_STYLE].update({
+    '1A': ((1, 19), (11, 14)),
+    '1C': ((12, 19), (11, 14)),
+    '1E': ((23, 21), (10, 12)),
+})
+
+# style ID -> printed bubble geometry, in timing mark cells: half width and
+# half height (to the middle of the outline), offset of the bubble center from
+# the center of its timing mark cell (x right, y down), and the corner radius
+# of a rounded rectangle outline (None for an ellipse)
+BUBBLE_SHAPES = {
+    DEFAULT_STYLE: (0.3635, 0.1835, 0.0202, -0.0815, None),
+    HUMBOLDT_STYLE: (0.39, 0.24, 0.0, 0.02, 0.16),
+}
+
+# bubble options of each contest, in the order the scanner reads them
+OPTIONS = ["Yes", "No"]
+
+###############################################################################
+# REQUIRES: A style ID, or None.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the bubble geometry of the style, or that of the default
+#           style if the style has none registered.
+def get_bubble_shape(style):
+    return BUBBLE_SHAPES.get(style, BUBBLE_SHAPES[DEFAULT_STYLE])
+
+###############################################################################
+# REQUIRES: A style ID that fits in the bottom row code columns.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the sorted list of bottom row columns that must carry a
+#           timing mark for the given style, parity mark included.
+def style_to_columns(style):
+    assert 0 <= style < 2 ** len(STYLE_CODE_COLUMNS), "Style ID out of range"
+
+    columns = list(STYLE_FIXED_COLUMNS)
+    for bit, column in enumerate(STYLE_CODE_COLUMNS):
+        if style & (1 << bit):
+            columns.append(column)
+    if bin(style).count("1") % 2:
+        columns.append(STYLE_PARITY_COLUMN)
+
+    return sorted(columns)
+
+###############################################################################
+# REQUIRES: The bottom row columns that carry a timing mark.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the style ID encoded by the columns, or None if the
+#           pattern is not a valid style code (missing fixed marks, marks
+#           outside of the code and parity columns, or odd parity).
+def columns_to_style(columns):
+    columns = set(columns)
+    code_columns = columns.difference(STYLE_FIXED_COLUMNS)
+
+    if not set(STYLE_FIXED_COLUMNS).issubset(columns):
+        return None
+    if not code_columns.issubset(STYLE_CODE_COLUMNS + [STYLE_PARITY_COLUMN]):
+        return None
+    if len(code_columns) % 2:
+        return None
+
+    style = 0
+    for bit, column in enumerate(STYLE_CODE_COLUMNS):
+        if column in columns:
+            style |= 1 << bit
+
+    return style
+
+###############################################################################
+# REQUIRES: The path of a timing mark coordinates file, one "(x, y)" per line.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the list of (x, y) grid cells in the file.
+def read_template(timing_mark_coordinates):
+    coordinates = []
+
+    with open(timing_mark_coordinates, "r") as ifile:
+        for line in ifile:
+            line = line.strip()
+            if not line:
+                continue
+
+            x_coord, y_coord = line.strip("()").split(",")
+            coordinates.append((int(x_coord.strip()), int(y_coord.strip())))
+
+    return coordinates
+
+###############################################################################
+# REQUIRES: A style ID in LAYOUTS.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns a list of (contest ID, option, (x, y)) for every bubble of
+#           the style, contests sorted by ID and options in OPTIONS order. The
+#           (x, y) cells are in scanner orientation (row 0 is the top row).
+def get_bubble_cells(style):
+    bubbles = []
+
+    for contest, ((column, row), dimensions) in sorted(LAYOUTS[style].items()):
+        rows = {"Yes": row + 1, "No": row}
+        for option in OPTIONS:
+            bubbles.append((contest, option, (column, NUM_V_MARKS - 1 - rows[option])))
+
+    return bubbles
+
+###############################################################################
+# REQUIRES: A style ID in LAYOUTS.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns a list of (contest ID, (left, top, right, bottom)) for the
+#           printed box of every contest, sorted by ID. The edges are in
+#           scanner oriented cells and fall halfway between timing marks.
+def get_contest_boxes(style):
+    boxes = []
+
+    for contest, ((column, row), (width, height)) in sorted(LAYOUTS[style].items()):
+        top_row = NUM_V_MARKS - 1 - (row + height - 1)
+        bottom_row = NUM_V_MARKS - 1 - row
+        boxes.append((contest, (column - 0.5, top_row - 0.5,
+                                column + width - 0.5, bottom_row + 0.5)))
+
+    return boxes
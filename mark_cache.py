@@ -0,0 +1,139 @@
+"""Per-target mark measurements cache, for re-tabulating without re-imaging."""
+
+import numpy as np
+import argparse
+import os
+from layouts import OPTIONS
+
+# one row per bubble of every scanned ballot, stored column by column (text
+# columns as ASCII bytes, to keep an election's worth of rows in memory; the
+# path is unicode, as wide as the longest, so no file name is cut off)
+COLUMNS = {
+    "ballot": "S40",        # SHA1 of the ballot image, as in the .sha files
+    "path": str,            # file the ballot was last scanned from
+    "style": np.int32,      # ballot style, -1 if scanned with a -t template
+    "contest": "S16",
+    "option": "S8",
+    "cell_x": np.int16,     # layout cell
+    "cell_y": np.int16,
+    "pixel_x": np.float32,  # calibrated bubble position
+    "pixel_y": np.float32,
+    "contour": bool,        # a filled contour was found in the read window
+    "fill": np.float32,     # mean ink inside the printed outline, 0 to 1
+    "outline": np.float32,  # integrity score of the printed outline
+    "residual_x": np.int8,  # printed outline offset from the calibrated
+    "residual_y": np.int8,  # position, in pixels
+}
+
+# answer for (yes filled) + 2 * (no filled), as in scanner.check_bubbles
+ANSWERS = np.array(["Neither", "Yes", "No", "Both"])
+
+###############################################################################
+# REQUIRES: Nothing.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns an empty table: column name -> array.
+def new_table():
+    return {column: np.zeros(0, dtype = dtype) for column, dtype in COLUMNS.items()}
+
+###############################################################################
+# REQUIRES: The path of a cache file written by save_table.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the table in the file, or an empty table if the file does
+#           not exist yet.
+def load_table(path):
+    if not os.path.isfile(path):
+        return new_table()
+
+    with np.load(path) as data:
+        return {column: data[column].astype(dtype) for column, dtype in COLUMNS.items()}
+
+###############################################################################
+# REQUIRES: A table and the path of the cache file.
+# MODIFIES: The cache file.
+# EFFECTS:  Writes the table to the file, one compressed array per column.
+def save_table(table, path):
+    with open(path, "wb") as ofile:
+        np.savez_compressed(ofile, **table)
+
+###############################################################################
+# REQUIRES: A table and a list of per ballot tables (column name -> list or
+#           array, every column present).
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the table with the ballots added. Rows of a ballot already
+#           in the table, or scanned again later in the list, are replaced by
+#           those of its last scan.
+def add_ballots(table, ballots):
+    if not ballots:
+        return table
+
+    # keep the last scan of every ballot in the list
+    latest = []
+    seen = set()
+    for ballot in reversed(ballots):
+        if ballot["ballot"][0] not in seen:
+            seen.add(ballot["ballot"][0])
+            latest.append(ballot)
+    ballots = latest[::-1]
+
+    new_rows = {column: np.concatenate([np.asarray(ballot[column], dtype = dtype) for ballot in ballots])
+                for column, dtype in COLUMNS.items()}
+    keep = ~np.isin(table["ballot"], new_rows["ballot"])
+
+    return {column: np.concatenate([table[column][keep], new_rows[column]]) for column in COLUMNS}
+
+###############################################################################
+# REQUIRES: A table, and optionally a fill threshold.
+# MODIFIES: Nothing.
+# EFFECTS:  Decides every contest of every ballot in one pass. A bubble counts
+#           as filled if a contour was found in it or, when a fill threshold
+#           is given, if its fill reaches the threshold. Returns the ballot,
+#           path, style and contest of every contest, and its answer.
+def decide_contests(table, fill_threshold = None):
+    filled = table["contour"].copy()
+    if fill_threshold is not None:
+        filled |= table["fill"] >= fill_threshold
+
+    weights = np.zeros(len(filled), dtype = int)
+    for bit, option in enumerate(OPTIONS):
+        weights[table["option"] == option.encode()] = 1 << bit
+
+    # rows of a contest are adjacent (add_ballots keeps a ballot's rows
+    # together, in layout order), so groups start where either changes
+    starts = np.ones(len(filled), dtype = bool)
+    starts[1:] = ((table["ballot"][1:] != table["ballot"][:-1]) |
+                  (table["contest"][1:] != table["contest"][:-1]))
+    groups = np.cumsum(starts) - 1
+
+    codes = np.bincount(groups, weights = filled * weights, minlength = starts.sum()).astype(int)
+    rows = np.flatnonzero(starts)
+
+    return (table["ballot"][rows], table["path"][rows], table["style"][rows],
+            table["contest"][rows], ANSWERS[codes])
+
+###############################################################################
+def main(args):
+    assert os.path.isfile(args.cache_file), "Cache file does not exist"
+
+    table = load_table(args.cache_file)
+    ballots, paths, styles, contests, answers = decide_contests(table, args.fill_threshold)
+
+    # write output file, grouped by ballot like the scanner's batch output ....
+    ofile = open(args.output_file, "w+")
+
+    previous_ballot = None
+    for ballot, path, style, answer in zip(ballots, paths, styles, answers):
+        if ballot != previous_ballot:
+            ofile.write("# " + path + " (" + ballot.decode() + ", style " + str(style) + ")\n")
+            previous_ballot = ballot
+        ofile.write(answer + "\n")
+
+    ofile.close()
+
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-tabulate cached mark measurements")
+    parser.add_argument('cache_file', type=str, help="Mark cache written by scanner.py -c")
+    parser.add_argument('output_file', type=str, help="File to output results")
+    parser.add_argument('-f', '--fill-threshold', type=float, default=None,
+                        help="Also count bubbles with at least this fill as marked (0 to 1)")
+    main(parser.parse_args())
@@ -3,15 +3,91 @@
 import numpy as np
 import argparse
 import cv2
+import hashlib
 import os
-import re
-
-BALLOT_WIDTH = 34
-BALLOT_HEIGHT = 41
+from multiprocessing import Pool
+from ballot_index import FINGERPRINT_BITS, add_fingerprint, find_near_duplicates, load_index, save_index
+from mark_cache import add_ballots, load_table, save_table
+from layouts import LAYOUTS, NUM_H_MARKS, NUM_V_MARKS, OPTIONS, STYLE_ANCHOR_COLUMN, \
+    STYLE_FIXED_COLUMNS, columns_to_style, get_bubble_cells, get_bubble_shape, get_contest_boxes, \
+    read_template
+
+BALLOT_WIDTH = NUM_H_MARKS
+BALLOT_HEIGHT = NUM_V_MARKS
+
+# half width and half height, in timing mark cells, of the window a bubble is
+# read from, and the area windows are clipped to: inside the frame of timing
+# marks, half a cell in from their centers (left, top, right, bottom cells)
+READ_WINDOW_X = 2.1
+READ_WINDOW_Y = 0.8
+READ_AREA = (0.5, 0.5, BALLOT_WIDTH - 1.5, BALLOT_HEIGHT - 1.5)
+
+# fingerprinted window around each marked bubble (half width and half
+# height, in timing mark cells), the samples taken across it, the blur (in
+# cells) that absorbs resampling and scanner noise, and the seed of the
+# random projections every scan must share
+FINGERPRINT_WINDOW_X = 0.5
+FINGERPRINT_WINDOW_Y = 0.35
+FINGERPRINT_SAMPLES_X = 32
+FINGERPRINT_SAMPLES_Y = 22
+FINGERPRINT_BLUR = 0.04
+FINGERPRINT_SEED = 2009
+
+# target windows around each bubble, in timing mark cells (scaled to pixels
+# by the measured pitch): half thickness of the outline, width of the band
+# outside it checked for stray ink (the window ends there), how far from the
+# middle of the contest box line ink still belongs to the line (the Humboldt
+# box line runs a tenth of a cell from the bubble), and how far the outline
+# is searched for to absorb calibration error (kept well under a row, so a
+# shifted row of bubbles is still caught)
+OUTLINE_THICKNESS = 0.04
+STRAY_MARGIN = 0.03
+STRAY_PIXELS = 2
+BOX_LINE_MARGIN = 0.04
+TARGET_SHIFT_X = 0.08
+TARGET_SHIFT_Y = 0.16
+
+# the line ballotbuilder draws out from the left edge of a bubble at
+# mid-height (BAD_YES/BAD_NO): how far out from the outline it is looked for,
+# and how far above and below it the paper must be lighter (still on the
+# straight part of the edge, so the outline and the box line, dark there too,
+# are not taken for it), by how many gray levels, and over how many adjacent
+# columns (the edge of a round voter's mark is darker at mid-height over one
+# or two)
+LEAD_REACH = 0.2
+LEAD_GUARD = 0.08
+LEAD_CONTRAST = 40
+LEAD_COLUMNS = 3
+
+# contest box edges: samples per edge, and how far off the expected line (in
+# timing mark cells) the printed line may be
+BOX_EDGE_SAMPLES = 8
+BOX_EDGE_TOLERANCE = 0.1
+
+# gray level below which a pixel counts as ink, as stray ink next to a bubble
+# (the bubble outline itself prints lighter), and as part of the outline
+# (scanned outlines can be a faint gray)
+DARK_PIXEL = 150
+STRAY_PIXEL = 200
+OUTLINE_PIXEL = 220
+
+# bubbles with at least this fill are marked: strokes of the voter's mark
+# often cross the outline, so only unmarked bubbles are checked for stray ink
+# all around it (every bubble is checked for a line at its left edge)
+MARKED_FILL = 0.1
+
+# ballots whose worst target scores below this are flagged as altered
+INTEGRITY_THRESHOLD = 0.3
 map_timing_marks = np.zeros([BALLOT_WIDTH, BALLOT_HEIGHT], dtype = object)
 row_to_slope = np.zeros([BALLOT_HEIGHT], dtype = object)
 COLUMN_TO_SLOPE = 0
 
+# style ID -> compiled layout, preloaded once per process
+style_registry = {}
+
+# number of fingerprint samples -> random projections, built once per process
+projection_registry = {}
+
 ###############################################################################
 # REQUIRES: The section (either, "row", "left", or "right"), all the shapes
 #           found on the image (contours), and the name of the ballot (img).
@@ -28,7 +104,14 @@ def get_list_of_section_shapes(section, contours, img):
         if cv2.contourArea(shape) > 150:
             out_of_range = False
 
+            # the column marks sit a few pixels inside their bound, so the far
+            # corner of an end mark crosses it on a slightly rotated scan: their
+            # center must be inside, and the rest of the mark close by
+            center_x, center_y = get_center_of_mass(shape)
+
             for vertex in shape:
+                far_from_center = max(abs(vertex[0][0] - center_x), abs(vertex[0][1] - center_y)) > 30
+
                 # check does not sink below certain y range
                 if section == "row":
                     y_coord = vertex[0][1]
@@ -37,26 +120,20 @@ def get_list_of_section_shapes(section, contours, img):
                         out_of_range = True
                 # check does not pass certain x range
                 elif section == "left":
-                    x_coord = vertex[0][0]
-
-                    if (x_coord > 50):
+                    if (center_x > 50 or far_from_center):
                         out_of_range = True
                 # check does not pass certain x range
                 elif section == "right":
                     ballot_width = img.shape[1]
-                    x_coord = vertex[0][0]
 
-                    if (x_coord < ballot_width - 50):
+                    if (center_x < ballot_width - 50 or far_from_center):
                         out_of_range = True
-                # check within range
+                # check within bottom row
                 elif section == "bottom":
-                    x_coord = vertex[0][0]
                     y_coord = vertex[0][1]
 
                     if (y_coord < 1530):
                         out_of_range = True
-                    if (x_coord < 400 or x_coord > 800):
-                        out_of_range = True
 
             # grab shapes that are in the section
             if not out_of_range:
@@ -83,14 +160,33 @@ def get_list_of_section_shapes(section, contours, img):
         print("ERROR: Invalid ballot. Left column of timing marks is not 41.")
         print("--------------------------------------------------------------")
         exit(1)
-    elif (section == "bottom" and len(shapes_in_section) != 1):
+    elif (section == "bottom" and len(shapes_in_section) < len(STYLE_FIXED_COLUMNS)):
         print("--------------------------------------------------------------")
-        print("ERROR: Invalid ballot. Bottom row of timing marks is not 1.")
+        print("ERROR: Invalid ballot. Bottom row of timing marks is too short.")
         print("--------------------------------------------------------------")
         exit(1)
 
     return shapes_in_section
 
+###############################################################################
+# REQUIRES: A shape found on the image.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the center of mass of the shape in (x, y) pixels: the
+#           centroid of its area, or the average of its vertices if it has
+#           none. (Averaging the vertices alone is pulled toward whichever
+#           edge the contour has more vertices on.)
+def get_center_of_mass(shape):
+    moments = cv2.moments(shape)
+
+    if moments["m00"] > 0:
+        average_x = int(round(moments["m10"] / moments["m00"]))
+        average_y = int(round(moments["m01"] / moments["m00"]))
+    else:
+        average_x = int(np.mean(shape[:, 0, 0]))
+        average_y = int(np.mean(shape[:, 0, 1]))
+
+    return (average_x, average_y)
+
 ###############################################################################
 # REQUIRES: The section (either, "row", "left", or "right") and a list of the
 #           shapes in the specified section.
@@ -103,24 +199,8 @@ def populate_section(section, shapes_in_section):
     center_of_masses_in_section = []
 
     for shape in shapes_in_section:
-        # define average variables
-        x_sum = 0
-        y_sum = 0
-        total_vertices = 0
-
-        # sum x coordinates, y coordinates, and total vertices in each shape
-        for vertex in shape:
-            x_sum += vertex[0][0]
-            y_sum += vertex[0][1]
-            total_vertices += 1
-
-        # calculate the center of mass (x, y) for each shape
-        average_x = int(x_sum / total_vertices)
-        average_y = int(y_sum / total_vertices)
-        center_of_mass = (average_x, average_y)
-
         # add to list (will sort later)
-        center_of_masses_in_section.append(center_of_mass)
+        center_of_masses_in_section.append(get_center_of_mass(shape))
 
     # sort center_of_masses_in_top_row by x value
     if section == "row":
@@ -140,11 +220,11 @@ def populate_section(section, shapes_in_section):
         elif section == "right":
             map_timing_marks[BALLOT_WIDTH - 1][i] = x
         elif section == "bottom":
-            # coordinates of the bottom tick
+            # coordinates of the bottom anchor tick
             coord_bottom = x
 
             # coordinates of the top tick
-            coord_top = map_timing_marks[17][0]
+            coord_top = map_timing_marks[STYLE_ANCHOR_COLUMN][0]
 
             # get slope
             if coord_top[0] == coord_bottom[0]:
@@ -155,6 +235,43 @@ def populate_section(section, shapes_in_section):
                 # add to data structure
                 COLUMN_TO_SLOPE = slope
 
+###############################################################################
+# REQUIRES: The shapes in the bottom row, after the top row of map_timing_marks
+#           has been populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Matches each bottom row shape to the nearest top row column
+#           (corrected for skew) and decodes the column pattern into a style
+#           ID (the corner marks belong to the left and right columns and are
+#           skipped). Returns the style ID (None if the pattern is not a valid
+#           style code, or two shapes fall in one column) and the shape of the
+#           anchor tick.
+def decode_bottom_row(shapes_bottom):
+    top_x_coords = [map_timing_marks[i][0][0] for i in range(BALLOT_WIDTH)]
+
+    # on skewed scans the bottom row sits sideways of the top row, by about
+    # as much as the left column's bottom mark sits from its top mark
+    skew_x = map_timing_marks[0][BALLOT_HEIGHT - 1][0] - map_timing_marks[0][0][0]
+
+    columns = {}
+    crowded = False
+    for shape in shapes_bottom:
+        x_coord = get_center_of_mass(shape)[0] - skew_x
+        column = min(range(BALLOT_WIDTH), key = lambda i: abs(top_x_coords[i] - x_coord))
+        if 0 < column < BALLOT_WIDTH - 1:
+            # a smudge next to a mark must not pass for it
+            crowded |= column in columns
+            columns.setdefault(column, shape)
+
+    if STYLE_ANCHOR_COLUMN not in columns:
+        print("--------------------------------------------------------------")
+        print("ERROR: Invalid ballot. Bottom row has no anchor timing mark.")
+        print("--------------------------------------------------------------")
+        exit(1)
+
+    style = None if crowded else columns_to_style(columns.keys())
+
+    return style, columns[STYLE_ANCHOR_COLUMN]
+
 ###############################################################################
 # REQUIRES:
 # MODIFIES: The numpy 2D array map_timing_marks.
@@ -174,10 +291,46 @@ def calculate_list_of_slopes():
             row_to_slope[i] = slope
 
 ###############################################################################
-# REQUIRES:
+# REQUIRES: After the top row of map_timing_marks has been populated.
+# MODIFIES: row_to_slope.
+# EFFECTS:  Gives every row the tilt of the top row of timing marks. Used when
+#           the right column does not match the left: its marks would be paired
+#           with the wrong rows, and a row's tilt carries across the whole row.
+def use_top_row_slope():
+    coord_left = map_timing_marks[0][0]
+    coord_right = map_timing_marks[BALLOT_WIDTH - 1][0]
+
+    row_to_slope[:] = (coord_left[1] - coord_right[1]) / (coord_left[0] - coord_right[0])
+
+###############################################################################
+# REQUIRES: The shapes in the right column, after the top row and the left
+#           column of map_timing_marks have been populated.
 # MODIFIES: Nothing.
-# EFFECTS:  Returns a list of the shapes in the specified section.
-def get_bubble(x_coord_bubble, y_coord_bubble, contours, img):
+# EFFECTS:  Returns True if the shapes pair up with the left column marks row
+#           by row: one per row, each as far above or below its left mark as
+#           the rest, to within half a pitch. A missed mark and a stray shape
+#           keep the count but move the rows between them by a whole pitch.
+def right_column_matches_left(shapes_right):
+    if len(shapes_right) != BALLOT_HEIGHT:
+        return False
+
+    right_y = np.sort([get_center_of_mass(shape)[1] for shape in shapes_right])
+    left_y = np.array([map_timing_marks[0][i][1] for i in range(BALLOT_HEIGHT)])
+    offsets = right_y - left_y
+
+    pitch_x, pitch_y = get_pitch()
+
+    return bool(np.all(np.abs(offsets - np.median(offsets)) < pitch_y / 2))
+
+###############################################################################
+# REQUIRES: The (left, top, right, bottom) pixel bounds of the window a bubble
+#           is read from, all the shapes found on the image (contours), and
+#           the image.
+# MODIFIES: The image (draws the bubble if found).
+# EFFECTS:  Returns True if a filled bubble lies within the read window.
+def get_bubble(window, contours, img):
+    left, top, right, bottom = window
+
     for shape in contours:
         approx = cv2.approxPolyDP(shape,0.01*cv2.arcLength(shape,True),True)
         strikes = 0
@@ -193,15 +346,12 @@ def get_bubble(x_coord_bubble, y_coord_bubble, contours, img):
                 x_coord = vertex[0][0]
                 y_coord = vertex[0][1]
 
-                if (abs(y_coord_bubble - y_coord) > 30):
-                    out_of_range = True
-                elif y_coord < 700:
+                if y_coord < top or y_coord > bottom:
                     out_of_range = True
                     break
-                elif x_coord < 50 or x_coord > 1100:
-                    out_of_range = True
-                elif abs(x_coord_bubble - x_coord) > 80:
+                elif x_coord < left or x_coord > right:
                     out_of_range = True
+                    break
 
             # only allow small percent of strikes
             if strikes / num_vertices > 0.9:
@@ -217,63 +367,475 @@ def get_bubble(x_coord_bubble, y_coord_bubble, contours, img):
     return False
 
 ###############################################################################
-# REQUIRES:
-# MODIFIES:
-def grab_casted_vote(timing_mark_coordinates, output_file, contours, img):
-    ofile = open(timing_mark_coordinates, "r")
-
-    first_bubble = False
-    second_bubble = False
-
-    # loop through coordinates in timing mark file
-    for i, line in enumerate(ofile):
-        # grab timing mark coordinates from file
-        coordinate = line.rstrip()  # strip new line
-        coordinate = coordinate.strip("(")  # remove parenthesis
-        coordinate = coordinate.strip(")")  # remove parenthesis
-        coordinate = re.split(',', coordinate)  # split by comma
-        x_coord = int(coordinate[0].strip())  # remove whitespace
-        y_coord = int(coordinate[1].strip())  # remove whitespace
-
-        # find pixel coordinates
-        top_coord = map_timing_marks[x_coord][0]
-        left_coord = map_timing_marks[0][y_coord]
-        x_calibration = 0
-        
-        if COLUMN_TO_SLOPE == 0:
-            x_calibration = 0
-        else:
-            x_calibration = (y_coord / BALLOT_HEIGHT) * (1600 / COLUMN_TO_SLOPE)
-        y_calibration = x_coord * row_to_slope[y_coord]
-
-        x_coord_bubble = top_coord[0] + x_calibration
-        y_coord_bubble = left_coord[1] + y_calibration
-
-        # debug comments
-        # print("------------------------------------------------------------")
-        # print("timing mark coordinates:", line, end='')
-        # print("pixel coordinates: (" + str(x_coord_bubble) + ", " + str(y_coord_bubble) + ")")
-        # print("x-slope:", row_to_slope[y_coord])
-        # print("y-slope:", COLUMN_TO_SLOPE)
+# REQUIRES: The style ID of the layout (None for a hand-written template), a
+#           list of (contest ID, option, (x, y)) for every bubble, options in
+#           OPTIONS order within each contest, and optionally a list of
+#           (contest ID, (left, top, right, bottom)) contest boxes in cells.
+# MODIFIES: Nothing.
+# EFFECTS:  Compiles the bubbles into the arrays the scanner reads from: the
+#           style, the list of contest IDs, and the grid cell, read window
+#           (left, top, right, bottom cells, clipped to READ_AREA), contest
+#           and option of every bubble. The contest box edges are compiled
+#           into the (x, y) cells of the points sampled along them
+#           (box_points), the direction across the edge to search for the
+#           printed line at each point (box_normals) and the contest of each
+#           point (box_index); all three are empty without boxes.
+def compile_bubbles(style, bubbles, boxes = ()):
+    contests = []
+    for contest, option, cell in bubbles:
+        if contest not in contests:
+            contests.append(contest)
+
+    # sample points along the edges of every contest box, with the direction
+    # to search for the printed line
+    box_points = []
+    box_normals = []
+    box_index = []
+    fractions = (np.arange(BOX_EDGE_SAMPLES) + 0.5) / BOX_EDGE_SAMPLES
+
+    for contest, (left, top, right, bottom) in boxes:
+        for fraction in fractions:
+            x_cell = left + (right - left) * fraction
+            y_cell = top + (bottom - top) * fraction
+
+            box_points += [(x_cell, top), (x_cell, bottom), (left, y_cell), (right, y_cell)]
+            box_normals += [(0, 1), (0, 1), (1, 0), (1, 0)]
+            box_index += [contests.index(contest)] * 4
+
+    cells = np.array([cell for contest, option, cell in bubbles], dtype = int).reshape(-1, 2)
+    windows = np.concatenate([cells - (READ_WINDOW_X, READ_WINDOW_Y), cells + (READ_WINDOW_X, READ_WINDOW_Y)], axis = 1)
+    windows = np.clip(windows, READ_AREA[:2] * 2, READ_AREA[2:] * 2)
+
+    return {
+        "style": style,
+        "contests": contests,
+        "cells": cells,
+        "windows": windows,
+        "contest_index": np.array([contests.index(contest) for contest, option, cell in bubbles], dtype = int),
+        "option_index": np.array([OPTIONS.index(option) for contest, option, cell in bubbles], dtype = int),
+        "box_points": np.array(box_points, dtype = float).reshape(-1, 2),
+        "box_normals": np.array(box_normals, dtype = int).reshape(-1, 2),
+        "box_index": np.array(box_index, dtype = int),
+    }
 
+###############################################################################
+# REQUIRES: A style ID in LAYOUTS.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the compiled layout of the style.
+def compile_layout(style):
+    return compile_bubbles(style, get_bubble_cells(style), get_contest_boxes(style))
 
+###############################################################################
+# REQUIRES: A list of (x, y) bubble grid cells, in yes/no pairs.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns a compiled layout for a hand-written template, contests
+#           numbered in template order.
+def compile_template(coordinates):
+    bubbles = [(str(i // len(OPTIONS) + 1), OPTIONS[i % len(OPTIONS)], cell)
+               for i, cell in enumerate(coordinates)]
+
+    return compile_bubbles(None, bubbles)
+
+###############################################################################
+# REQUIRES: Arrays of (x, y) grid cells, possibly fractional, after
+#           map_timing_marks, row_to_slope and COLUMN_TO_SLOPE have been
+#           populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the calibrated pixel coordinates (x, y) of every cell, as
+#           two arrays. Fractional cells are interpolated between marks.
+def locate_cells(x_cells, y_cells):
+    x_cells = np.asarray(x_cells, dtype = float)
+    y_cells = np.asarray(y_cells, dtype = float)
+
+    top_x_coords = np.array([map_timing_marks[i][0][0] for i in range(BALLOT_WIDTH)], dtype = float)
+    left_x_coords = np.array([map_timing_marks[0][i][0] for i in range(BALLOT_HEIGHT)], dtype = float)
+    left_y_coords = np.array([map_timing_marks[0][i][1] for i in range(BALLOT_HEIGHT)], dtype = float)
+    slopes = np.interp(y_cells, np.arange(BALLOT_HEIGHT), row_to_slope.astype(float))
+
+    top_x = np.interp(x_cells, np.arange(BALLOT_WIDTH), top_x_coords)
+    left_x = np.interp(y_cells, np.arange(BALLOT_HEIGHT), left_x_coords)
+    left_y = np.interp(y_cells, np.arange(BALLOT_HEIGHT), left_y_coords)
+
+    if COLUMN_TO_SLOPE == 0:
+        x_calibration = np.zeros(len(x_cells))
+    else:
+        x_calibration = (y_cells / BALLOT_HEIGHT) * (1600 / COLUMN_TO_SLOPE)
+    # follow the row's tilt from its left timing mark
+    y_calibration = (top_x - left_x) * slopes
+
+    x_coords = top_x + x_calibration
+    y_coords = left_y + y_calibration
+
+    return x_coords, y_coords
+
+###############################################################################
+# REQUIRES: A compiled layout, after map_timing_marks, row_to_slope and
+#           COLUMN_TO_SLOPE have been populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the calibrated pixel coordinates (x, y) of every bubble in
+#           the layout, as two arrays.
+def locate_bubbles(layout):
+    return locate_cells(layout["cells"][:, 0], layout["cells"][:, 1])
+
+###############################################################################
+# REQUIRES: A compiled layout, after map_timing_marks, row_to_slope and
+#           COLUMN_TO_SLOPE have been populated.
+# MODIFIES: The image (draws the bubbles found).
+# EFFECTS:  Returns the list of answers, one per contest, and whether each
+#           bubble of the layout is filled in.
+def grab_casted_vote(layout, contours, img):
+    # read windows in pixels: each edge located on the bubble's row or column
+    x_cells, y_cells = layout["cells"][:, 0], layout["cells"][:, 1]
+    windows = layout["windows"]
+    left = locate_cells(windows[:, 0], y_cells)[0]
+    right = locate_cells(windows[:, 2], y_cells)[0]
+    top = locate_cells(x_cells, windows[:, 1])[1]
+    bottom = locate_cells(x_cells, windows[:, 3])[1]
+
+    filled = np.zeros(len(layout["cells"]), dtype = bool)
+    for i, window in enumerate(zip(left, top, right, bottom)):
         # with coordinates, check if bubble filled in
-        bubble = get_bubble(x_coord_bubble, y_coord_bubble, contours, img)
-        # print("bubble:", bubble)
-        # print("------------------------------------------------------------")
+        filled[i] = get_bubble(window, contours, img)
 
-        # save bubble
-        if (i + 1) % 2 != 0:  # odd
-            first_bubble = bubble
-        else:  # even
-            second_bubble = bubble
+    # bubbles[contest][option] -> filled in
+    bubbles = np.zeros([len(layout["contests"]), len(OPTIONS)], dtype = bool)
+    bubbles[layout["contest_index"], layout["option_index"]] = filled
 
-            answer = check_bubbles(first_bubble, second_bubble)
+    answers = [check_bubbles(yes_bubble, no_bubble) for yes_bubble, no_bubble in bubbles]
 
-            # append to output file
-            ofile = open(output_file, "a+")  # append, create if does not exist
-            ofile.write(answer + "\n")
-            ofile.close()
+    return answers, filled
+
+###############################################################################
+# REQUIRES: A (blurred) grayscale image, the pixel centers of n windows and
+#           the pixel offsets of the samples across them.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the (n, rows, columns) ink in the windows, 0 on white,
+#           interpolated between pixels.
+def sample_windows(gray, x_centers, y_centers, x_offsets, y_offsets):
+    shape = (len(x_centers), len(y_offsets), len(x_offsets))
+    map_x = np.broadcast_to(x_centers[:, None, None] + x_offsets[None, None, :], shape)
+    map_y = np.broadcast_to(y_centers[:, None, None] + y_offsets[None, :, None], shape)
+
+    windows = cv2.remap(gray, map_x.reshape(-1, shape[2]).astype(np.float32),
+                        map_y.reshape(-1, shape[2]).astype(np.float32),
+                        cv2.INTER_LINEAR, borderValue = 255)
+
+    return 255 - windows.reshape(shape)
+
+###############################################################################
+# REQUIRES: The number of samples fingerprinted.
+# MODIFIES: projection_registry.
+# EFFECTS:  Returns the (FINGERPRINT_BITS, size) seeded random projections
+#           every scan of this size shares, generating them on first use.
+def get_projections(size):
+    if size not in projection_registry:
+        projection_registry[size] = np.random.RandomState(FINGERPRINT_SEED).standard_normal((FINGERPRINT_BITS, size))
+
+    return projection_registry[size]
+
+###############################################################################
+# REQUIRES: The grayscale image, the bubble measurements from check_integrity
+#           and the bubble geometry printed on the ballot, after
+#           map_timing_marks has been populated.
+# MODIFIES: projection_registry, if no ballot of this size was preloaded.
+# EFFECTS:  Returns a FINGERPRINT_BITS bit hash of the shape of the voter's
+#           marks, or None if no bubble is marked. Every marked bubble is
+#           sampled finely around the centroid of its ink, less the printing
+#           (the mean of the unmarked bubbles), and unmarked bubbles count as
+#           blank, so two hands marking the same bubbles still differ. The
+#           samples are hashed by the signs of seeded random projections, so
+#           the Hamming distance between two fingerprints follows the angle
+#           between their marks: a re-fed ballot lands within a few bits of
+#           its first scan.
+def get_fingerprint(gray, measurements, shape):
+    marked = measurements["fill"] >= MARKED_FILL
+    if not marked.any():
+        return None
+
+    pitch_x, pitch_y = get_pitch()
+    blurred = cv2.GaussianBlur(gray, (0, 0), FINGERPRINT_BLUR * (pitch_x + pitch_y) / 2).astype(np.float32)
+
+    x_centers = measurements["pixel_x"] + measurements["residual_x"] + shape[2] * pitch_x
+    y_centers = measurements["pixel_y"] + measurements["residual_y"] + shape[3] * pitch_y
+    x_offsets = np.linspace(-FINGERPRINT_WINDOW_X, FINGERPRINT_WINDOW_X, FINGERPRINT_SAMPLES_X) * pitch_x
+    y_offsets = np.linspace(-FINGERPRINT_WINDOW_Y, FINGERPRINT_WINDOW_Y, FINGERPRINT_SAMPLES_Y) * pitch_y
+
+    windows = sample_windows(blurred, x_centers, y_centers, x_offsets, y_offsets)
+    printing = windows[~marked].mean(axis = 0) if not marked.all() else 0
+
+    # re-center every window on its ink, so the scan's registration drops out
+    ink = np.clip(windows - printing, 0, None)
+    total = np.maximum(ink.sum(axis = (1, 2)), 1e-9)
+    x_shifts = (ink * x_offsets[None, None, :]).sum(axis = (1, 2)) / total
+    y_shifts = (ink * y_offsets[None, :, None]).sum(axis = (1, 2)) / total
+
+    marks = sample_windows(blurred, x_centers + x_shifts, y_centers + y_shifts, x_offsets, y_offsets)
+    marks -= printing
+    marks[~marked] = 0
+
+    projections = get_projections(marks.size)
+
+    fingerprint = 0
+    for projection in projections @ marks.reshape(-1):
+        fingerprint = (fingerprint << 1) | int(projection > 0)
+
+    return fingerprint
+
+###############################################################################
+# REQUIRES: After map_timing_marks has been populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the (x, y) pitch of the timing marks, in pixels per cell.
+def get_pitch():
+    pitch_x = (map_timing_marks[BALLOT_WIDTH - 1][0][0] - map_timing_marks[0][0][0]) / (BALLOT_WIDTH - 1)
+    pitch_y = (map_timing_marks[0][BALLOT_HEIGHT - 1][1] - map_timing_marks[0][0][1]) / (BALLOT_HEIGHT - 1)
+
+    return pitch_x, pitch_y
+
+###############################################################################
+# REQUIRES: A bubble geometry from layouts.BUBBLE_SHAPES and the timing mark
+#           pitch in pixels.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the expected bubble target at this scale: the (x, y)
+#           pixel offsets of the window pixels compared (the interior is
+#           skipped, so filled and empty bubbles both match), the zero mean
+#           unit length outline template over them, which of them form the
+#           stray ink band, the offsets inside the outline, the x offsets and
+#           guard row of the line left of the bubble, the offset of the bubble
+#           center and the (dx, dy) shifts to search.
+def get_target_template(shape, pitch):
+    half_width, half_height, offset_x, offset_y, corner = shape
+    pitch_x, pitch_y = pitch
+    scale = (pitch_x + pitch_y) / 2
+
+    a = half_width * pitch_x
+    b = half_height * pitch_y
+    thickness = OUTLINE_THICKNESS * scale
+    stray_start = thickness + 0.5
+    stray_end = stray_start + STRAY_MARGIN * scale
+    reach_x = int(np.ceil(a + stray_end))
+    reach_y = int(np.ceil(b + stray_end))
+    y_offsets, x_offsets = np.mgrid[-reach_y : reach_y + 1, -reach_x : reach_x + 1]
+
+    # signed distance from the outline in pixels, negative inside
+    if corner is None:
+        # first order: the ellipse equation divided by its gradient
+        x_scaled = x_offsets / a
+        y_scaled = y_offsets / b
+        radius = np.sqrt(x_scaled ** 2 + y_scaled ** 2)
+        gradient = np.sqrt((x_scaled / a) ** 2 + (y_scaled / b) ** 2)
+        distance = (radius - 1) * radius / np.maximum(gradient, 1e-9)
+    else:
+        r = corner * scale
+        q_x = np.abs(x_offsets) - (a - r)
+        q_y = np.abs(y_offsets) - (b - r)
+        distance = (np.hypot(np.maximum(q_x, 0), np.maximum(q_y, 0)) +
+                    np.minimum(np.maximum(q_x, q_y), 0) - r)
+
+    # half a pixel of anti-aliasing separates the outline from stray ink
+    outline = np.abs(distance) <= thickness
+    compared = (distance >= -thickness) & (distance <= stray_end)
+    stray = distance > stray_start
+    inside = distance < -thickness - 0.5
+
+    template = outline[compared].astype(float)
+    template -= template.mean()
+    template /= np.linalg.norm(template)
+
+    # columns left of the bubble, from the middle of its outline out to
+    # LEAD_REACH, so a line across the gap to the box line spans a few
+    lead_x = -np.arange(int(np.ceil(a)), int(np.floor(a + LEAD_REACH * scale)) + 1)
+
+    shift_x = int(round(TARGET_SHIFT_X * pitch_x))
+    shift_y = int(round(TARGET_SHIFT_Y * pitch_y))
+
+    return {
+        "x": x_offsets[compared],
+        "y": y_offsets[compared],
+        "outline": template.astype(np.float32),
+        "stray": stray[compared],
+        "interior_x": x_offsets[inside],
+        "interior_y": y_offsets[inside],
+        "lead_x": lead_x,
+        "lead_guard": int(round(LEAD_GUARD * pitch_y)),
+        "center": (offset_x * pitch_x, offset_y * pitch_y),
+        "box_margin": BOX_LINE_MARGIN * pitch_x,
+        "shifts": np.array([(dx, dy) for dx in range(-shift_x, shift_x + 1)
+                            for dy in range(-shift_y, shift_y + 1)]),
+    }
+
+###############################################################################
+# REQUIRES: The grayscale image and an (n, k) array each of pixel rows and
+#           columns, possibly off the image.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the (n, k) gray levels, clamping to the image border.
+def sample_pixels(gray, rows, cols):
+    rows = np.clip(rows, 0, gray.shape[0] - 1)
+    cols = np.clip(cols, 0, gray.shape[1] - 1)
+
+    return gray[rows, cols]
+
+###############################################################################
+# REQUIRES: The grayscale image, the calibrated pixel coordinates of every
+#           bubble and of the printed line to its left (-inf if none), the
+#           tilt of every bubble's row, and a target template from
+#           get_target_template.
+# MODIFIES: Nothing.
+# EFFECTS:  Correlates every bubble window against the expected outline, all
+#           bubbles and shifts at once. Returns per bubble a score in [0, 1]
+#           (the best outline correlation, lowered by stray ink next to the
+#           outline of an unmarked bubble, 0 if a line runs out from the left
+#           edge of any bubble), the (dx, dy) shift of the best match, and the
+#           fill: the mean ink in [0, 1] inside the outline at that shift.
+def check_bubble_targets(gray, x_coords_bubble, y_coords_bubble, x_coords_line, slopes, template):
+    shifts = template["shifts"]
+    x_centers = np.round(x_coords_bubble + template["center"][0]).astype(int)
+    y_centers = np.round(y_coords_bubble + template["center"][1]).astype(int)
+
+    # (shift, bubble, pixel)
+    cols = x_centers[None, :, None] + shifts[:, 0, None, None] + template["x"][None, None, :]
+    rows = y_centers[None, :, None] + shifts[:, 1, None, None] + template["y"][None, None, :]
+    pixels = sample_pixels(gray, rows, cols)
+
+    # matched on thresholded ink, so that faint outlines and dark marks weigh
+    # the same; the template has zero mean, so only the window's spread needs
+    # its mean
+    ink = (pixels < OUTLINE_PIXEL).astype(np.float32)
+    spread = ink.sum(axis = 2) - ink.sum(axis = 2) ** 2 / ink.shape[2]
+    correlations = (ink @ template["outline"]) / np.sqrt(np.maximum(spread, 1e-9))
+
+    best = correlations.argmax(axis = 0)
+    bubbles = np.arange(len(x_centers))
+
+    residuals = shifts[best]
+    cols_best = (x_centers + residuals[:, 0])[:, None] + template["x"][None, :]
+    cols = (x_centers + residuals[:, 0])[:, None] + template["interior_x"][None, :]
+    rows = (y_centers + residuals[:, 1])[:, None] + template["interior_y"][None, :]
+    fills = 1 - sample_pixels(gray, rows, cols).mean(axis = 1) / 255
+
+    outline_scores = np.clip(correlations[best, bubbles], 0, 1)
+    off_line = np.abs(cols_best - x_coords_line[:, None]) > template["box_margin"]
+    stray_pixels = ((pixels[best, bubbles] < STRAY_PIXEL) & template["stray"] & off_line).sum(axis = 1)
+    stray_scores = np.clip(1 - stray_pixels / STRAY_PIXELS, 0, 1)
+    stray_scores[fills >= MARKED_FILL] = 1
+
+    # a line at mid-height, out from the outline past the box line margin,
+    # darker than the paper above and below it on two adjacent rows, followed
+    # along the row's tilt: marked bubbles are checked too, as that is where
+    # such a line changes the vote
+    guard = template["lead_guard"]
+    lead_x = template["lead_x"]
+    tilt = np.round(slopes[:, None] * lead_x[None, :]).astype(int)
+
+    # (bubble, row, column)
+    cols = (x_centers + residuals[:, 0])[:, None, None] + lead_x[None, None, :]
+    rows = ((y_centers + residuals[:, 1])[:, None] + tilt)[:, None, :] + \
+        np.array([-guard, -1, 0, 1, guard])[None, :, None]
+    lead = sample_pixels(gray, rows, cols).astype(int)
+
+    paper = lead[:, [0, 4]].min(axis = 1)
+    dark = (lead[:, 1:4] < STRAY_PIXEL) & (lead[:, 1:4] <= paper[:, None, :] - LEAD_CONTRAST)
+    line = (dark[:, 1] & (dark[:, 0] | dark[:, 2]) &
+            (cols[:, 0] > x_coords_line[:, None] + template["box_margin"]))
+    runs = np.lib.stride_tricks.sliding_window_view(line, LEAD_COLUMNS, axis = 1).all(axis = 2)
+    stray_scores[runs.any(axis = 1)] = 0
+
+    return np.minimum(outline_scores, stray_scores), residuals, fills
+
+###############################################################################
+# REQUIRES: The grayscale image, the calibrated pixel coordinates of every
+#           bubble, a target template from get_target_template and the
+#           timing mark pitch.
+# MODIFIES: Nothing.
+# EFFECTS:  Returns the x coordinate of the printed line (the contest box
+#           edge) running down the left of every bubble: the darkest column,
+#           over the bubble's height, within BOX_EDGE_TOLERANCE of the
+#           bubble, or -inf where no column is dark enough.
+def find_box_lines(gray, x_coords_bubble, y_coords_bubble, template, pitch):
+    left = template["x"].min()
+    reach = int(np.ceil(BOX_EDGE_TOLERANCE * pitch[0]))
+    offsets = np.arange(left - reach, left + 1)
+    heights = np.arange(-int(pitch[1] / 4), int(pitch[1] / 4) + 1)
+
+    # (bubble, offset, row)
+    x_centers = np.round(x_coords_bubble + template["center"][0]).astype(int)
+    y_centers = np.round(y_coords_bubble + template["center"][1]).astype(int)
+    cols = x_centers[:, None, None] + offsets[None, :, None]
+    rows = y_centers[:, None, None] + heights[None, None, :]
+    profiles = sample_pixels(gray, rows, cols).mean(axis = 2)
+    darkest = profiles.argmin(axis = 1)
+
+    x_coords_line = (x_centers + offsets[darkest]).astype(float)
+    x_coords_line[profiles.min(axis = 1) >= DARK_PIXEL] = -np.inf
+
+    return x_coords_line
+
+###############################################################################
+# REQUIRES: The grayscale image, a compiled layout and the timing mark pitch,
+#           after map_timing_marks has been populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Looks for the printed line at every sampled point of every contest
+#           box edge, all at once, and returns per contest the fraction of
+#           points where it was found.
+def check_box_targets(gray, layout, pitch):
+    num_contests = len(layout["contests"])
+    if len(layout["box_points"]) == 0:
+        return np.ones(num_contests)
+
+    x_coords, y_coords = locate_cells(layout["box_points"][:, 0], layout["box_points"][:, 1])
+    reach = int(np.ceil(BOX_EDGE_TOLERANCE * max(pitch)))
+    offsets = np.arange(-reach, reach + 1)
+
+    # (point, offset across the edge)
+    cols = np.round(x_coords).astype(int)[:, None] + layout["box_normals"][:, 0, None] * offsets
+    rows = np.round(y_coords).astype(int)[:, None] + layout["box_normals"][:, 1, None] * offsets
+    found = sample_pixels(gray, rows, cols).min(axis = 1) < DARK_PIXEL
+
+    found_per_contest = np.bincount(layout["box_index"], weights = found, minlength = num_contests)
+    points_per_contest = np.bincount(layout["box_index"], minlength = num_contests)
+
+    return found_per_contest / np.maximum(points_per_contest, 1)
+
+###############################################################################
+# REQUIRES: The grayscale image, a compiled layout and the bubble geometry
+#           printed on the ballot, after map_timing_marks, row_to_slope and
+#           COLUMN_TO_SLOPE have been populated.
+# MODIFIES: Nothing.
+# EFFECTS:  Checks that the printed bubbles and contest boxes are where the
+#           layout says, at the scale of the measured timing mark pitch.
+#           Returns the ballot score (its worst target, 1 when all targets are
+#           intact), the names of targets scoring below INTEGRITY_THRESHOLD,
+#           and the measurements of every bubble (pixel position, outline
+#           score, residual shift and fill).
+def check_integrity(gray, layout, shape):
+    pitch = get_pitch()
+    template = get_target_template(shape, pitch)
+    x_coords_bubble, y_coords_bubble = locate_bubbles(layout)
+    x_coords_line = find_box_lines(gray, x_coords_bubble, y_coords_bubble, template, pitch)
+
+    slopes = np.interp(layout["cells"][:, 1], np.arange(BALLOT_HEIGHT), row_to_slope.astype(float))
+
+    bubble_scores, residuals, fills = check_bubble_targets(gray, x_coords_bubble, y_coords_bubble,
+                                                           x_coords_line, slopes, template)
+    box_scores = check_box_targets(gray, layout, pitch)
+
+    names = [layout["contests"][c] + " " + OPTIONS[o]
+             for c, o in zip(layout["contest_index"], layout["option_index"])]
+    names += [contest + " box" for contest in layout["contests"]]
+    scores = np.concatenate([bubble_scores, box_scores])
+
+    flagged = [name for name, score in zip(names, scores) if score < INTEGRITY_THRESHOLD]
+    score = float(scores.min()) if len(scores) else 1.0
+
+    measurements = {
+        "pixel_x": x_coords_bubble,
+        "pixel_y": y_coords_bubble,
+        "outline": bubble_scores,
+        "fill": fills,
+        "residual_x": residuals[:, 0],
+        "residual_y": residuals[:, 1],
+    }
+
+    return score, flagged, measurements
 
 ###############################################################################
 def check_bubbles(first_bubble, second_bubble):
@@ -287,19 +849,45 @@ def check_bubbles(first_bubble, second_bubble):
         return "Both"
 
 ###############################################################################
-def main(args):
-    assert os.path.isfile(args.input_file), "Input file does not exist"
-    assert os.path.isfile(args.timing_mark_coordinates), "Timing mark file does not exist"
-    # assert not os.path.isfile(args.output_file), "Output file already exists"
+# REQUIRES: Nothing.
+# MODIFIES: style_registry, projection_registry.
+# EFFECTS:  Loads every registered template, and the fingerprint projections
+#           for ballots of its size, into this process. Used as the pool
+#           initializer so every worker preloads them once.
+def init_style_registry():
+    for style in LAYOUTS:
+        style_registry[style] = compile_layout(style)
+        get_projections(len(style_registry[style]["cells"]) * FINGERPRINT_SAMPLES_Y * FINGERPRINT_SAMPLES_X)
 
-    # img = cv2.imread('shapes.png')
-    # img = cv2.imread('shapes.jpg')
-    img = cv2.imread(args.input_file)
+###############################################################################
+# REQUIRES: The ballot image, and optionally a compiled layout to use instead
+#           of the one registered for the ballot's style.
+# MODIFIES: map_timing_marks, row_to_slope, COLUMN_TO_SLOPE.
+# EFFECTS:  Scans the ballot and returns its result (style ID, answers,
+#           fingerprint, integrity score and flagged targets) and the
+#           annotated image. The result also holds the ballot's SHA1 and
+#           its mark cache rows, one per bubble.
+def scan_ballot(input_file, layout=None):
+    with open(input_file, "rb") as ifile:
+        ballot_hash = hashlib.sha1(ifile.read()).hexdigest()
+
+    img = cv2.imread(input_file)
+    if img is None:
+        print("--------------------------------------------------------------")
+        print("ERROR: Invalid ballot. " + input_file + " is not an image.")
+        print("--------------------------------------------------------------")
+        exit(1)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     ret,thresh = cv2.threshold(gray,150,255,1)
     contours,h = cv2.findContours(thresh,1,2)
 
+    # start from an empty grid, a process scans many ballots in a batch .......
+    global COLUMN_TO_SLOPE
+    map_timing_marks[:] = 0
+    row_to_slope[:] = 0
+    COLUMN_TO_SLOPE = 0
+
     # populate map_timing_marks ...............................................
 
     # populate the top row of map_timing_marks -> (0, 0) to (34, 0)
@@ -312,34 +900,203 @@ def main(args):
 
     # populate the right column of map_timing_marks -> (34, 0) to (34, 41)
     shapes_right = get_list_of_section_shapes("right", contours, img)
-    populate_section("right", shapes_right)
 
     # calculate list of slopes ................................................
 
-    # get left to right tilt
-    calculate_list_of_slopes()
+    # get left to right tilt, from the top row if the right column is off
+    if right_column_matches_left(shapes_right):
+        populate_section("right", shapes_right)
+        calculate_list_of_slopes()
+    else:
+        use_top_row_slope()
 
-    # get top to bottom tilt
+    # identify ballot style from the bottom row ...............................
     shapes_bottom = get_list_of_section_shapes("bottom", contours, img)
-    populate_section("bottom", shapes_bottom)
+    style, shape_anchor = decode_bottom_row(shapes_bottom)
+
+    # get top to bottom tilt
+    populate_section("bottom", [shape_anchor])
 
     # check where vote was cast ...............................................
+    if layout is None:
+        if style is None:
+            print("--------------------------------------------------------------")
+            print("ERROR: Invalid ballot. Bottom row is not a valid style code.")
+            print("--------------------------------------------------------------")
+            exit(1)
+        if style not in style_registry:
+            print("--------------------------------------------------------------")
+            print("ERROR: Unknown ballot style " + str(style) + ".")
+            print("--------------------------------------------------------------")
+            exit(1)
+
+        layout = style_registry[style]
+
+    # check the printed targets are where the layout says ....................
+    shape = get_bubble_shape(style if layout["style"] is None else layout["style"])
+    integrity, flagged, measurements = check_integrity(gray, layout, shape)
+
+    # read the marks off the contest box lines: a mark touching a line would
+    # join it into one shape, too big and too long to be a bubble
+    pitch_x, pitch_y = get_pitch()
+    box_lines = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, np.ones((int(pitch_y), 1), np.uint8))
+    marks, h = cv2.findContours(cv2.subtract(thresh, box_lines), 1, 2)
+
+    answers, filled = grab_casted_vote(layout, marks, img)
+
+    # fingerprint the voter's marks ...........................................
+    fingerprint = get_fingerprint(gray, measurements, shape)
+
+    # raw measurements, keyed by ballot and layout cell .......................
+    num_bubbles = len(layout["cells"])
+    targets = {
+        "ballot": [ballot_hash] * num_bubbles,
+        "path": [input_file] * num_bubbles,
+        "style": [-1 if layout["style"] is None else layout["style"]] * num_bubbles,
+        "contest": [layout["contests"][c] for c in layout["contest_index"]],
+        "option": [OPTIONS[o] for o in layout["option_index"]],
+        "cell_x": layout["cells"][:, 0],
+        "cell_y": layout["cells"][:, 1],
+        "contour": filled,
+    }
+    targets.update(measurements)
+
+    result = {
+        "style": style,
+        "hash": ballot_hash,
+        "answers": answers,
+        "fingerprint": fingerprint,
+        "integrity": integrity,
+        "flagged": flagged,
+        "targets": targets,
+    }
+
+    return result, img
 
-    # reset output file
-    file = open(args.output_file, "w+")
-    file.close()
+###############################################################################
+# REQUIRES: The ballot image and an optional template override.
+# MODIFIES: Nothing.
+# EFFECTS:  Pool worker. Returns the path of the ballot image and its result,
+#           or None for the result if the ballot is invalid.
+def scan_ballot_worker(task):
+    input_file, layout = task
+
+    try:
+        result, img = scan_ballot(input_file, layout)
+    except SystemExit:
+        return input_file, None
+
+    return input_file, result
+
+###############################################################################
+def main(args):
+    for input_file in args.input_files:
+        assert os.path.isfile(input_file), "Input file does not exist: " + input_file
 
-    grab_casted_vote(args.timing_mark_coordinates, args.output_file, contours, img)
+    layout = None
+    if args.timing_mark_coordinates is not None:
+        assert os.path.isfile(args.timing_mark_coordinates), "Timing mark file does not exist"
+        layout = compile_template(read_template(args.timing_mark_coordinates))
+    # assert not os.path.isfile(args.output_file), "Output file already exists"
+
+    # scan ballots, styles may be mixed .......................................
+    tasks = [(input_file, layout) for input_file in args.input_files]
+
+    if args.show:
+        # show ballot timing marks, one ballot at a time
+        init_style_registry()
+        results = []
+        for input_file, layout in tasks:
+            result, img = scan_ballot(input_file, layout)
+            results.append((input_file, result))
+
+            cv2.imshow('img',img)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+    elif args.jobs > 1:
+        with Pool(args.jobs, initializer = init_style_registry) as pool:
+            results = pool.map(scan_ballot_worker, tasks)
+    else:
+        init_style_registry()
+        results = [scan_ballot_worker(task) for task in tasks]
+
+    # a single invalid ballot is an error, a batch just marks it
+    if len(results) == 1 and results[0][1] is None:
+        exit(1)
+
+    # check for altered ballot layouts ........................................
+    for input_file, result in results:
+        if result is not None and result["integrity"] < INTEGRITY_THRESHOLD:
+            print("--------------------------------------------------------------")
+            print("WARNING: " + input_file + " layout looks altered (score %.2f)." % result["integrity"])
+            print("         Targets: " + ", ".join(result["flagged"]))
+            print("--------------------------------------------------------------")
+
+    # check for re-fed ballots ................................................
+    duplicates = {}
+
+    if args.index is not None:
+        index = load_index(args.index)
+
+        for input_file, result in results:
+            # blank ballots carry no marks to tell them apart
+            if result is None or result["fingerprint"] is None:
+                continue
+
+            # ballots are keyed by image hash: the same image scanned again,
+            # under any file name, is not a re-fed ballot (a re-feed is a new
+            # scan of the sheet)
+            fingerprint = result["fingerprint"]
+            matches = find_near_duplicates(index, fingerprint)
+            matches = [key for distance, key in matches if key != result["hash"]]
+            if matches:
+                duplicates[input_file] = index["paths"][matches[0]]
+                print("--------------------------------------------------------------")
+                print("WARNING: " + input_file + " looks like a re-fed " + duplicates[input_file] + ".")
+                print("--------------------------------------------------------------")
+
+            add_fingerprint(index, result["hash"], fingerprint, input_file)
+
+        save_index(index, args.index)
+
+    # cache raw measurements for re-tabulation ................................
+    if args.cache is not None:
+        table = load_table(args.cache)
+        table = add_ballots(table, [result["targets"] for input_file, result in results
+                                    if result is not None])
+        save_table(table, args.cache)
+
+    # write output file .......................................................
+    ofile = open(args.output_file, "w+")
+
+    for input_file, result in results:
+        if len(results) > 1:
+            if result is None:
+                ofile.write("# " + input_file + " (invalid ballot)\n")
+                continue
+            header = "# " + input_file + " (style " + str(result["style"]) + ")"
+            if result["integrity"] < INTEGRITY_THRESHOLD:
+                header += " (altered layout, score %.2f)" % result["integrity"]
+            if input_file in duplicates:
+                header += " (duplicate of " + duplicates[input_file] + ")"
+            ofile.write(header + "\n")
+
+        for answer in result["answers"]:
+            ofile.write(answer + "\n")
 
-    # show ballot timing marks ................................................
-    cv2.imshow('img',img)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+    ofile.close()
 
 ###############################################################################
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Scanner parser")
-    parser.add_argument('input_file', type=str, help="File to scan")
-    parser.add_argument('timing_mark_coordinates', type=str, help="Timing mark coordinates")
+    parser.add_argument('input_files', type=str, nargs='+', help="File(s) to scan")
     parser.add_argument('output_file', type=str, help="File to output results")
+    parser.add_argument('-t', '--timing-mark-coordinates', type=str, default=None,
+                        help="Timing mark coordinates. If blank, the layout of the ballot style is used.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('-i', '--index', type=str, default=None,
+                        help="Fingerprint index file to check for re-fed ballots (created if missing)")
+    parser.add_argument('-c', '--cache', type=str, default=None,
+                        help="Mark cache file to store per bubble measurements in (created if missing)")
+    parser.add_argument('--show', action='store_true', help="Show the scanned ballot timing marks")
     main(parser.parse_args())
@@ -0,0 +1,94 @@
+import random
+
+from ballot_index import (CHUNK_BITS, CHUNK_SHIFTS, DUPLICATE_DISTANCE, FINGERPRINT_BITS,
+                          NUM_CHUNKS, add_fingerprint, find_near_duplicates, load_index, new_index,
+                          save_index)
+
+
+def flip_bits(fingerprint, bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def clustered_index(rng, num_clusters = 20, cluster_size = 60, spread = 12):
+    # ballots voted alike sit close together, as real fingerprints do
+    index = new_index()
+    for cluster in range(num_clusters):
+        center = rng.getrandbits(FINGERPRINT_BITS)
+        for member in range(cluster_size):
+            fingerprint = flip_bits(center, rng.sample(range(FINGERPRINT_BITS), spread))
+            key = "%040x" % rng.getrandbits(160)
+            add_fingerprint(index, key, fingerprint, "ballot %d-%d.jpg" % (cluster, member))
+    return index
+
+
+def brute_force(index, fingerprint, max_distance = DUPLICATE_DISTANCE):
+    matches = []
+    for key, other in index["fingerprints"].items():
+        distance = bin(other ^ fingerprint).count("1")
+        if distance <= max_distance:
+            matches.append((distance, key))
+    return sorted(matches)
+
+
+def test_recall_at_the_duplicate_distance():
+    rng = random.Random(2009)
+    index = clustered_index(rng)
+    keys = sorted(index["fingerprints"])
+
+    for i in range(200):
+        key = rng.choice(keys)
+        query = flip_bits(index["fingerprints"][key],
+                          rng.sample(range(FINGERPRINT_BITS), DUPLICATE_DISTANCE))
+        matches = find_near_duplicates(index, query)
+        assert (DUPLICATE_DISTANCE, key) in matches
+        assert matches == brute_force(index, query)
+
+
+def test_recall_with_flips_spread_over_every_chunk():
+    # the pigeonhole worst case: the flips spread as evenly over the chunks
+    # as they go, so at most one chunk is left as close as the probe radius
+    rng = random.Random(2009)
+    index = clustered_index(rng)
+
+    for key in sorted(index["fingerprints"])[:100]:
+        bits = []
+        for chunk in range(NUM_CHUNKS):
+            flips = DUPLICATE_DISTANCE // NUM_CHUNKS + (chunk < DUPLICATE_DISTANCE % NUM_CHUNKS)
+            bits += rng.sample(range(CHUNK_SHIFTS[chunk], CHUNK_SHIFTS[chunk] + CHUNK_BITS[chunk]), flips)
+        query = flip_bits(index["fingerprints"][key], bits)
+        assert (DUPLICATE_DISTANCE, key) in find_near_duplicates(index, query)
+
+
+def test_no_match_beyond_the_duplicate_distance():
+    rng = random.Random(2009)
+    index = new_index()
+    fingerprint = rng.getrandbits(FINGERPRINT_BITS)
+    add_fingerprint(index, "a" * 40, fingerprint, "a.jpg")
+
+    query = flip_bits(fingerprint, rng.sample(range(FINGERPRINT_BITS), DUPLICATE_DISTANCE + 1))
+    assert find_near_duplicates(index, query) == []
+
+
+def test_same_image_replaces_its_entry():
+    index = new_index()
+    add_fingerprint(index, "a" * 40, 1, "first/a.jpg")
+    add_fingerprint(index, "a" * 40, 3, "second/a.jpg")
+
+    assert index["fingerprints"] == {"a" * 40: 3}
+    assert index["paths"] == {"a" * 40: "second/a.jpg"}
+    assert find_near_duplicates(index, 3) == [(0, "a" * 40)]
+
+
+def test_save_and_load(tmp_path):
+    rng = random.Random(2009)
+    index = clustered_index(rng, num_clusters = 2, cluster_size = 5)
+    path = str(tmp_path / "index.txt")
+
+    save_index(index, path)
+    loaded = load_index(path)
+
+    assert loaded["fingerprints"] == index["fingerprints"]
+    assert loaded["paths"] == index["paths"]
+    assert loaded["tables"] == index["tables"]
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from pdf2image import convert_from_path
+from pdf2image.exceptions import PDFInfoNotInstalledError
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+import ballotbuilder
+import scanner
+from layouts import LAYOUTS
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Raleway-Regular.ttf")
+ANSWER_NAMES = {'-': "Neither", 'Y': "Yes", 'N': "No", 'B': "Both"}
+
+
+def render(tmp_path, style, answers, attack = 0):
+    # the builder's page, rasterized at the builder's resolution
+    pdf = str(tmp_path / "ballot.pdf")
+    c = canvas.Canvas(pdf, pagesize = ballotbuilder.PAGESIZE)
+    c.setStrokeColor(ballotbuilder.BLACK)
+    pdfmetrics.registerFont(TTFont('answer_font', FONT))
+    c.setFont('answer_font', 10)
+
+    axes = ballotbuilder.drawTimingMarks(c, style)
+    ballotbuilder.drawQuestions(c, axes, ballotbuilder.defineAttack(attack), style,
+                                ballotbuilder.defineAnswers(answers, style))
+    c.save()
+
+    image = str(tmp_path / "ballot.jpg")
+    try:
+        convert_from_path(pdf, dpi = 153)[0].save(image, 'JPEG')
+    except PDFInfoNotInstalledError:
+        pymupdf = pytest.importorskip("pymupdf", reason = "needs poppler or PyMuPDF to rasterize")
+        from PIL import Image
+        pixmap = pymupdf.open(pdf)[0].get_pixmap(dpi = 153)
+        Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples).save(image, 'JPEG')
+
+    return image
+
+
+@pytest.fixture(scope = "module", autouse = True)
+def style_registry():
+    scanner.init_style_registry()
+
+
+@pytest.mark.parametrize("style", sorted(LAYOUTS))
+@pytest.mark.parametrize("answers", ["YYNYYN", "YNBY-N", "BBBBBB", "------", "NYNYNY"])
+def test_builder_round_trip(tmp_path, style, answers):
+    result, img = scanner.scan_ballot(render(tmp_path, style, answers))
+
+    assert result["style"] == style
+    assert result["answers"] == [ANSWER_NAMES[a] for a in answers]
+    assert result["integrity"] >= scanner.INTEGRITY_THRESHOLD
+
+
+@pytest.mark.parametrize("style", sorted(LAYOUTS))
+def test_shifted_bubbles_are_flagged(tmp_path, style):
+    result, img = scanner.scan_ballot(render(tmp_path, style, None, attack = 2))
+
+    assert "1B No" in result["flagged"]
+
+
+@pytest.mark.parametrize("style", sorted(LAYOUTS))
+@pytest.mark.parametrize("attack, answers, read, target", [
+    # the line joins a marked bubble to the box line: the mark is still read
+    # off the line, and the flag tells
+    (1, "Y-----", "Yes", "1A Yes"),
+    (1, "------", "Neither", "1A Yes"),
+    (3, "N-----", "No", "1A No"),
+    (3, "------", "Neither", "1A No"),
+])
+def test_lines_next_to_bubbles_are_flagged(tmp_path, style, attack, answers, read, target):
+    result, img = scanner.scan_ballot(render(tmp_path, style, answers, attack = attack))
+
+    assert result["answers"][0] == read
+    assert target in result["flagged"]
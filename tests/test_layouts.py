@@ -0,0 +1,64 @@
+import itertools
+import random
+
+import pytest
+
+from layouts import (HUMBOLDT_STYLE, LAYOUTS, NUM_H_MARKS, STYLE_CODE_COLUMNS,
+                     STYLE_FIXED_COLUMNS, columns_to_style, style_to_columns)
+
+
+@pytest.mark.parametrize("style", sorted(LAYOUTS))
+def test_registered_styles_round_trip(style):
+    assert columns_to_style(style_to_columns(style)) == style
+
+
+def test_random_styles_round_trip():
+    rng = random.Random(2009)
+    for i in range(1000):
+        style = rng.randrange(2 ** len(STYLE_CODE_COLUMNS))
+        assert columns_to_style(style_to_columns(style)) == style
+
+
+def test_extreme_styles_round_trip():
+    for style in [0, 2 ** len(STYLE_CODE_COLUMNS) - 1]:
+        assert columns_to_style(style_to_columns(style)) == style
+
+
+def test_columns_stay_inside_the_bottom_row():
+    # every code column, with and without the parity mark
+    for style in [2 ** len(STYLE_CODE_COLUMNS) - 1, 2 ** (len(STYLE_CODE_COLUMNS) - 1) - 1]:
+        assert set(style_to_columns(style)) <= set(range(1, NUM_H_MARKS - 1))
+
+
+def test_humboldt_style_prints_the_scanned_marks():
+    # as printed on the May 2009 ballots in ballots/00 2
+    assert style_to_columns(HUMBOLDT_STYLE) == [1, 17, 25, 31, 32]
+    assert 25 not in style_to_columns(1)
+
+
+def test_registered_styles_are_two_marks_apart():
+    for first, second in itertools.combinations(sorted(LAYOUTS), 2):
+        assert len(set(style_to_columns(first)) ^ set(style_to_columns(second))) >= 2
+
+
+@pytest.mark.parametrize("style", sorted(LAYOUTS))
+def test_one_mark_more_or_less_is_invalid(style):
+    columns = set(style_to_columns(style))
+    for column in range(1, NUM_H_MARKS - 1):
+        assert columns_to_style(columns ^ {column}) is None
+
+
+def test_style_out_of_range():
+    with pytest.raises(AssertionError):
+        style_to_columns(2 ** len(STYLE_CODE_COLUMNS))
+
+
+@pytest.mark.parametrize("column", STYLE_FIXED_COLUMNS)
+def test_missing_fixed_mark_is_invalid(column):
+    columns = [c for c in style_to_columns(1) if c != column]
+    assert columns_to_style(columns) is None
+
+
+@pytest.mark.parametrize("column", [0, NUM_H_MARKS - 1])
+def test_corner_mark_is_invalid(column):
+    assert columns_to_style(style_to_columns(1) + [column]) is None
@@ -0,0 +1,105 @@
+import itertools
+
+import numpy as np
+
+from layouts import DEFAULT_STYLE, get_bubble_cells
+from mark_cache import COLUMNS, add_ballots, decide_contests, load_table, new_table, save_table
+from scanner import check_bubbles
+
+
+def make_ballot(ballot_hash, contours, fills = None, path = "ballot.jpg"):
+    # rows of one scanned ballot, in layout order like scanner.scan_ballot
+    bubbles = get_bubble_cells(DEFAULT_STYLE)
+    num_bubbles = len(bubbles)
+    if fills is None:
+        fills = [0.0] * num_bubbles
+
+    return {
+        "ballot": [ballot_hash] * num_bubbles,
+        "path": [path] * num_bubbles,
+        "style": [DEFAULT_STYLE] * num_bubbles,
+        "contest": [contest for contest, option, cell in bubbles],
+        "option": [option for contest, option, cell in bubbles],
+        "cell_x": [cell[0] for contest, option, cell in bubbles],
+        "cell_y": [cell[1] for contest, option, cell in bubbles],
+        "pixel_x": [0.0] * num_bubbles,
+        "pixel_y": [0.0] * num_bubbles,
+        "contour": contours,
+        "fill": fills,
+        "outline": [0.5] * num_bubbles,
+        "residual_x": [0] * num_bubbles,
+        "residual_y": [0] * num_bubbles,
+    }
+
+
+def test_decide_contests_matches_check_bubbles():
+    num_contests = len(get_bubble_cells(DEFAULT_STYLE)) // 2
+
+    # every yes/no combination in every contest, across several ballots
+    ballots = []
+    expected = []
+    combinations = list(itertools.product([False, True], repeat = 2))
+    for i in range(len(combinations)):
+        pairs = [combinations[(i + contest) % len(combinations)] for contest in range(num_contests)]
+        ballots.append(make_ballot("%040x" % i, [bubble for pair in pairs for bubble in pair]))
+        expected += [check_bubbles(yes, no) for yes, no in pairs]
+
+    table = add_ballots(new_table(), ballots)
+    hashes, paths, styles, contests, answers = decide_contests(table)
+
+    assert list(answers) == expected
+    assert len(hashes) == len(ballots) * num_contests
+    assert set(styles) == {DEFAULT_STYLE}
+
+
+def test_fill_threshold_counts_faint_marks():
+    num_bubbles = len(get_bubble_cells(DEFAULT_STYLE))
+    fills = [0.6 if i == 0 else 0.2 for i in range(num_bubbles)]
+    table = add_ballots(new_table(), [make_ballot("a" * 40, [False] * num_bubbles, fills)])
+
+    assert decide_contests(table)[-1][0] == "Neither"
+    assert decide_contests(table, 0.5)[-1][0] == check_bubbles(True, False)
+    assert set(decide_contests(table, 0.1)[-1]) == {"Both"}
+
+
+def test_add_ballots_keeps_the_last_scan():
+    num_bubbles = len(get_bubble_cells(DEFAULT_STYLE))
+    first = make_ballot("a" * 40, [False] * num_bubbles, path = "first.jpg")
+    other = make_ballot("b" * 40, [False] * num_bubbles)
+    last = make_ballot("a" * 40, [True] * num_bubbles, path = "last.jpg")
+
+    # the same ballot twice in one batch
+    table = add_ballots(new_table(), [first, other, last])
+    assert len(table["ballot"]) == 2 * num_bubbles
+    assert set(table["path"][table["ballot"] == b"a" * 40]) == {"last.jpg"}
+    assert table["contour"][table["ballot"] == b"a" * 40].all()
+
+    # and again in a later batch
+    table = add_ballots(table, [first])
+    assert len(table["ballot"]) == 2 * num_bubbles
+    assert set(table["path"][table["ballot"] == b"a" * 40]) == {"first.jpg"}
+
+
+def test_save_and_load(tmp_path):
+    num_bubbles = len(get_bubble_cells(DEFAULT_STYLE))
+    table = add_ballots(new_table(), [make_ballot("a" * 40, [True] * num_bubbles)])
+    path = str(tmp_path / "cache.npz")
+
+    save_table(table, path)
+    loaded = load_table(path)
+
+    for column in COLUMNS:
+        assert np.array_equal(loaded[column], table[column])
+
+
+def test_long_paths_are_kept_whole(tmp_path):
+    num_bubbles = len(get_bubble_cells(DEFAULT_STYLE))
+    path = "/".join(["Stimmzettel Wahlkreis Nürnberg-Süd"] * 10) + "/000001.jpg"
+    table = add_ballots(new_table(), [make_ballot("a" * 40, [True] * num_bubbles),
+                                      make_ballot("b" * 40, [True] * num_bubbles, path = path)])
+    cache = str(tmp_path / "cache.npz")
+
+    save_table(table, cache)
+    paths = decide_contests(load_table(cache))[1]
+
+    assert set(paths) == {"ballot.jpg", path}
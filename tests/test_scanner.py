@@ -0,0 +1,90 @@
+import os
+
+import cv2
+import pytest
+
+import scanner
+
+BALLOTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ballots", "00 2")
+SCANS = ["%06d.jpg" % number for number in range(1, 11)]
+
+
+def rotate(tmp_path, name, angle, shift):
+    # the scan as it would come out of a slightly crooked feed
+    img = cv2.imread(os.path.join(BALLOTS, name))
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    matrix[:, 2] += shift
+
+    image = str(tmp_path / name)
+    cv2.imwrite(image, cv2.warpAffine(img, matrix, (width, height), borderValue = (255, 255, 255)))
+
+    return image
+
+
+@pytest.fixture(scope = "module", autouse = True)
+def style_registry():
+    scanner.init_style_registry()
+
+
+@pytest.mark.parametrize("name", SCANS)
+def test_rotated_scan_reads_the_same(tmp_path, name):
+    result, img = scanner.scan_ballot(os.path.join(BALLOTS, name))
+    rotated, img = scanner.scan_ballot(rotate(tmp_path, name, 0.1, 1))
+
+    assert rotated["answers"] == result["answers"]
+    assert rotated["flagged"] == result["flagged"]
+
+
+# every Yes mark on 000004 runs into the contest box line left of it
+def test_marks_touching_the_box_line_are_read():
+    result, img = scanner.scan_ballot(os.path.join(BALLOTS, "000004.jpg"))
+
+    assert result["answers"] == ["Yes"] * 6
+
+
+# clockwise turns are shifted left, to keep the top right timing mark (printed
+# at the very edge of the scans) on the image
+@pytest.mark.parametrize("angle, shift", [
+    (-0.2, -2), (-0.1, -2), (-0.05, 0), (0.05, 0), (0.1, 1), (0.2, 1), (0.25, 0),
+])
+@pytest.mark.parametrize("name", SCANS)
+def test_rotated_scan_is_not_flagged(tmp_path, name, angle, shift):
+    result, img = scanner.scan_ballot(rotate(tmp_path, name, angle, shift))
+
+    assert result["flagged"] == []
+
+
+# the right column of the rotated scan still counts 41 shapes, but one is not
+# a timing mark and one mark is missing, so the rows between are off by one
+def test_right_column_off_by_a_row_falls_back_to_the_top_row(tmp_path):
+    result, img = scanner.scan_ballot(rotate(tmp_path, "000007.jpg", -0.25, 2))
+
+    assert result["answers"] == ["Yes", "Yes", "No", "Yes", "Yes", "Yes"]
+    assert result["flagged"] == []
+
+
+def test_unreadable_file_is_an_invalid_ballot(tmp_path):
+    path = tmp_path / "ballot.jpg"
+    path.write_bytes(b"not an image")
+
+    assert scanner.scan_ballot_worker((str(path), None)) == (str(path), None)
+
+
+# pixel boxes on the bottom row of 000002: its column 25 mark, white paper in
+# column 24, and paper just below the column 25 mark
+@pytest.mark.parametrize("box, color", [
+    ((955, 1562, 35, 14), 255),  # mark dropped: reads as style 1 without parity
+    ((910, 1565, 28, 10), 0),    # smudge in an empty column
+    ((950, 1582, 28, 10), 0),    # smudge next to a mark, in its column
+])
+def test_damaged_style_code_is_invalid(tmp_path, box, color):
+    img = cv2.imread(os.path.join(BALLOTS, "000002.jpg"))
+    x, y, width, height = box
+    img[y : y + height, x : x + width] = color
+
+    image = str(tmp_path / "000002.jpg")
+    cv2.imwrite(image, img)
+
+    with pytest.raises(SystemExit):
+        scanner.scan_ballot(image)